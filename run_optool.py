@@ -9,12 +9,16 @@ opacities, and composite core-mantle grain structures.
 
 import argparse
 import logging
+import os
 import re
-import shutil
-import subprocess
 import sys
+from functools import lru_cache, partial
 from pathlib import Path
 
+# subprocess, tempfile and concurrent.futures (which pulls in multiprocessing)
+# are imported where they are used so that importing the module and running
+# --help stay cheap. shutil is deferred too, though argparse loads it for help.
+
 log = logging.getLogger(__name__)
 
 # Default values
@@ -27,6 +31,9 @@ DEFAULT_OUTPUT_DIR = Path("radmc3d_model")
 # Regex for validating material names (alphanumeric, hyphens, underscores)
 _SAFE_MATERIAL_RE = re.compile(r"^[A-Za-z0-9_\-]+$")
 
+# Trailing temperature suffix on material names (e.g. "E40R_100K")
+_TEMP_SUFFIX_RE = re.compile(r"_\d+K$")
+
 # Material densities (g/cm^3)
 MATERIAL_DENSITIES: dict[str, float] = {
     "x035": 2.7,   # (0.65)MgO-(0.35)SiO2
@@ -53,8 +60,17 @@ def _validate_material_name(name: str) -> None:
         )
 
 
+@lru_cache(maxsize=1)
 def check_optool() -> bool:
-    """Check if Optool is installed and accessible."""
+    """Check if Optool is installed and accessible.
+
+    The result is cached for the lifetime of the interpreter.
+    """
+    import shutil
+    import subprocess
+
+    if shutil.which("optool") is None:
+        return False
     try:
         result = subprocess.run(
             ["optool", "--version"],
@@ -71,6 +87,44 @@ def check_optool() -> bool:
         return False
 
 
+# Per-process caches of .lnk directory listings and partial-match lookups
+_nk_dir_cache: dict[Path, frozenset[str]] = {}
+_nk_partial_cache: dict[tuple[Path, str], str | None] = {}
+
+
+def _list_nk_dir(nk_dir: Path) -> frozenset[str] | None:
+    """Return the regular file names in *nk_dir*, listing the directory only once.
+
+    Returns None if the directory does not exist.
+    """
+    names = _nk_dir_cache.get(nk_dir)
+    if names is None:
+        # scandir's file-type info comes from the directory read, so
+        # is_file() does not cost an extra stat() per entry
+        try:
+            with os.scandir(nk_dir) as entries:
+                names = frozenset(entry.name for entry in entries if entry.is_file())
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        _nk_dir_cache[nk_dir] = names
+    return names
+
+
+def _find_partial_match(nk_dir: Path, names: frozenset[str], material: str) -> str | None:
+    """Return the first .lnk name (sorted) containing *material*, case-insensitively."""
+    material_lower = material.lower()
+    key = (nk_dir, material_lower)
+    if key not in _nk_partial_cache:
+        match = None
+        for name in sorted(names):
+            name_lower = name.lower()
+            if name_lower.endswith(".lnk") and material_lower in name_lower:
+                match = name
+                break
+        _nk_partial_cache[key] = match
+    return _nk_partial_cache[key]
+
+
 def find_nk_file(
     material: str,
     temp: int | None = None,
@@ -83,28 +137,83 @@ def find_nk_file(
       2. Exact match               ({material}.lnk)
       3. Partial (case-insensitive) match among directory entries
     """
-    if not nk_dir.is_dir():
+    names = _list_nk_dir(nk_dir)
+    if names is None:
         log.error("Directory %s not found.", nk_dir)
         return None
 
+    name, exact = _match_nk_name(nk_dir, names, material, temp)
+    if name is None:
+        return None
+    if not exact and temp is not None:
+        log.warning("Using %s which may not match %dK exactly.", name, temp)
+    return nk_dir / name
+
+
+def _match_nk_name(
+    nk_dir: Path,
+    names: frozenset[str],
+    material: str,
+    temp: int | None,
+) -> tuple[str | None, bool]:
+    """Apply find_nk_file's search order without logging.
+
+    Returns the matching file name (or None) and whether it was an exact
+    (temperature-specific or plain) match rather than a partial one.
+    """
     if temp is not None:
-        temp_file = nk_dir / f"{material}_{temp}K.lnk"
-        if temp_file.exists():
-            return temp_file
+        temp_name = f"{material}_{temp}K.lnk"
+        if temp_name in names:
+            return temp_name, True
+
+    exact_name = f"{material}.lnk"
+    if exact_name in names:
+        return exact_name, True
+
+    return _find_partial_match(nk_dir, names, material), False
 
-    exact_file = nk_dir / f"{material}.lnk"
-    if exact_file.exists():
-        return exact_file
 
-    for path in sorted(nk_dir.iterdir()):
-        if path.suffix.lower() == ".lnk" and material.lower() in path.name.lower():
-            if temp is not None:
-                log.warning(
-                    "Using %s which may not match %dK exactly.", path.name, temp
-                )
-            return path
+def _local_inputs(
+    material: str,
+    temp: int | None,
+    nk_dir: Path,
+    mantle_material: str | None,
+    mantle_fraction: float | None,
+) -> list[Path]:
+    """Return the local .lnk files a run would read, without logging."""
+    names = _list_nk_dir(nk_dir)
+    if names is None:
+        return []
+    materials = [material]
+    if mantle_material and mantle_fraction:
+        materials.append(mantle_material)
+    inputs: list[Path] = []
+    for name in materials:
+        match, _ = _match_nk_name(nk_dir, names, name, temp)
+        if match is not None:
+            inputs.append(nk_dir / match)
+    return inputs
+
+
+# Directories already created (or found) by this process
+_ensured_dirs: set[Path] = set()
 
-    return None
+
+def _ensure_dir(path: Path) -> None:
+    """Create *path* (with parents) unless this process already did so."""
+    key = path.absolute()
+    if key not in _ensured_dirs:
+        key.mkdir(parents=True, exist_ok=True)
+        _ensured_dirs.add(key)
+
+
+def _is_up_to_date(target: Path, sources: list[Path]) -> bool:
+    """Return True if *target* exists and is newer than every file in *sources*."""
+    try:
+        target_mtime = target.stat().st_mtime
+    except FileNotFoundError:
+        return False
+    return all(source.stat().st_mtime < target_mtime for source in sources)
 
 
 def format_mantle_fraction(fraction: float | None) -> str:
@@ -114,6 +223,50 @@ def format_mantle_fraction(fraction: float | None) -> str:
     return f"{fraction:.10f}".rstrip("0").rstrip(".")
 
 
+@lru_cache(maxsize=None)
+def _output_prefix(
+    material: str,
+    mantle_material: str | None,
+    mantle_fraction: float | None,
+    scattering: bool,
+) -> str:
+    """Return the temperature- and size-independent part of an output file name.
+
+    Cached because it is identical for every run of a sweep.
+    """
+    base_output_name = "dustkapscatmat" if scattering else "dustkappa"
+    base_material = _TEMP_SUFFIX_RE.sub("", material)
+    mantle_suffix = (
+        f"_m{mantle_material}_{format_mantle_fraction(mantle_fraction)}"
+        if mantle_material
+        else ""
+    )
+    return f"{base_output_name}_{base_material}{mantle_suffix}"
+
+
+def _output_name(
+    material: str,
+    grain_size: float,
+    temp: int | None,
+    mantle_material: str | None,
+    mantle_fraction: float | None,
+    scattering: bool,
+) -> str:
+    """Return the output file name for one run."""
+    temp_part = f"_{temp}K" if temp else ""
+    return (
+        f"{_output_prefix(material, mantle_material, mantle_fraction, scattering)}"
+        f"{temp_part}_a{grain_size}.inp"
+    )
+
+
+@lru_cache(maxsize=None)
+def _optool_options(grain_size: float, scattering: bool) -> tuple[str, ...]:
+    """Return the Optool flags shared by every run of a sweep at one grain size."""
+    options = ("-radmc", "-a", str(grain_size))
+    return options + ("-s",) if scattering else options
+
+
 def run_optool(
     material: str,
     grain_size: float,
@@ -122,16 +275,40 @@ def run_optool(
     output_dir: Path = DEFAULT_OUTPUT_DIR,
     mantle_material: str | None = None,
     mantle_fraction: float | None = None,
+    scratch_dir: Path | None = None,
+    scattering: bool = False,
+    force: bool = False,
+    verbose: bool = False,
 ) -> Path | None:
     """Run Optool to generate a single opacity file.
 
+    With *scattering*, Optool is run with ``-s`` and the full scattering
+    matrix file (``dustkapscatmat_*.inp``) is produced instead of
+    ``dustkappa_*.inp``.
+
+    If *scratch_dir* is given, Optool writes into it and it is left in place
+    for reuse by the next call; otherwise a temporary directory is created
+    inside *output_dir* and removed afterwards.
+
+    An existing output file newer than its local .lnk inputs is reused
+    without running Optool, unless *force* is set.
+
+    Optool's stdout is discarded unless *verbose* is set.
+
     Returns the path to the generated file, or None on failure.
     """
-    output_dir.mkdir(parents=True, exist_ok=True)
+    import errno
+    import shutil
+    import subprocess
+    import tempfile
+
+    _ensure_dir(output_dir)
 
     # Resolve core material
+    input_files: list[Path] = []
     nk_file = find_nk_file(material, temp, nk_dir)
     if nk_file:
+        input_files.append(nk_file)
         core_arg = str(nk_file)
     else:
         log.info("Using built-in optool material: %s", material)
@@ -142,20 +319,42 @@ def run_optool(
     if mantle_material and mantle_fraction:
         mantle_nk = find_nk_file(mantle_material, temp, nk_dir)
         if mantle_nk:
+            input_files.append(mantle_nk)
             mantle_arg = str(mantle_nk)
         else:
             log.info("Using built-in optool material for mantle: %s", mantle_material)
             mantle_arg = mantle_material
 
-    temp_dir = output_dir / "temp_optool"
-    temp_dir.mkdir(parents=True, exist_ok=True)
+    final_name = _output_name(
+        material, grain_size, temp, mantle_material, mantle_fraction, scattering
+    )
+    final_path = output_dir / final_name
+
+    if not force and _is_up_to_date(final_path, input_files):
+        log.info("Skipping %s, up to date.", final_name)
+        return final_path
+
+    # Optool always uses the same output file name, so it needs a private directory
+    owns_temp_dir = scratch_dir is None
+    temp_dir = (
+        scratch_dir
+        if scratch_dir is not None
+        else Path(
+            tempfile.mkdtemp(prefix=f"temp_optool_{temp or 'notemp'}_", dir=output_dir)
+        )
+    )
+    source_file = temp_dir / (
+        "dustkapscatmat.inp" if scattering else "dustkappa.inp"
+    )
 
     try:
+        # Never mistake a leftover from a previous failed run for fresh output
+        source_file.unlink(missing_ok=True)
+
         cmd: list[str] = [
             "optool",
             core_arg,
-            "-radmc",
-            "-a", str(grain_size),
+            *_optool_options(grain_size, scattering),
             "-o", str(temp_dir),
         ]
 
@@ -171,25 +370,27 @@ def run_optool(
             )
         log.info("Running Optool for %s...", " ".join(status_parts))
 
-        subprocess.run(cmd, capture_output=True, text=True, check=True)
+        # Only stderr is needed for diagnostics; let stdout through in verbose mode
+        subprocess.run(
+            cmd,
+            stdout=None if verbose else subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+            check=True,
+        )
 
-        source_file = temp_dir / "dustkappa.inp"
         if not source_file.exists():
             log.error("Expected output file %s not found.", source_file)
             return None
 
-        # Build final filename
-        base_material = re.sub(r"_\d+K$", "", material)
-        mantle_suffix = (
-            f"_m{mantle_material}_{format_mantle_fraction(mantle_fraction)}"
-            if mantle_material
-            else ""
-        )
-        temp_part = f"_{temp}K" if temp else ""
-        final_name = f"dustkappa_{base_material}{mantle_suffix}{temp_part}_a{grain_size}.inp"
-
-        final_path = output_dir / final_name
-        shutil.copy2(source_file, final_path)
+        # A rename when temp_dir shares output_dir's filesystem (always the
+        # case for our own temp dirs); a caller-supplied scratch_dir may not
+        try:
+            os.replace(source_file, final_path)
+        except OSError as exc:
+            if exc.errno != errno.EXDEV:
+                raise
+            shutil.move(source_file, final_path)
 
         log.info("Generated: %s", final_name)
         return final_path
@@ -205,11 +406,51 @@ def run_optool(
         log.exception("Unexpected error")
         return None
     finally:
-        if temp_dir.exists():
-            shutil.rmtree(temp_dir)
+        if owns_temp_dir:
+            # Empty after a successful rename; fall back to rmtree for leftovers
+            try:
+                temp_dir.rmdir()
+            except OSError:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+# Scratch directory owned by the current pool worker, set by _init_worker
+_worker_scratch_dir: Path | None = None
+
+
+def _configure_logging(verbose: bool) -> None:
+    """Set up the console log format and level used by the CLI."""
+    logging.basicConfig(
+        format="%(levelname)s: %(message)s",
+        level=logging.DEBUG if verbose else logging.INFO,
+    )
+
+
+def _init_worker(batch_dir: Path, verbose: bool) -> None:
+    """Set up logging and a private scratch directory in each pool worker.
+
+    Workers started with spawn or forkserver do not inherit the parent's
+    logging configuration, so it is applied again here.
+    """
+    import tempfile
+
+    _configure_logging(verbose)
+
+    global _worker_scratch_dir
+    _worker_scratch_dir = Path(tempfile.mkdtemp(prefix="worker_", dir=batch_dir))
+
+
+def _run_optool_in_worker(
+    run: partial[Path | None],
+    grain_size: float,
+    temp: int | None,
+) -> Path | None:
+    """Call a prepared run_optool partial using the worker's scratch directory."""
+    return run(grain_size, temp, scratch_dir=_worker_scratch_dir)
 
 
-def main() -> int:
+def build_parser() -> argparse.ArgumentParser:
+    """Build the command-line argument parser."""
     parser = argparse.ArgumentParser(
         description="Generate dust opacity files using Optool",
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -224,12 +465,18 @@ Examples:
   # Custom temperatures
   python run_optool.py --temperatures 50,150,250
 
+  # Grain-size sweep (one file per size and temperature)
+  python run_optool.py --material E40R --grain-sizes 0.1,0.3,1.0
+
   # Single temperature-independent file
   python run_optool.py --material E40R --grain-size 0.3 --no-temp-dependent
 
   # Core-mantle grain with local materials (20% x035 mantle on E40R core)
   python run_optool.py --material E40R --grain-size 0.3 --mantle-material x035 --mantle-fraction 0.2
 
+  # Full scattering matrix (dustkapscatmat_*.inp) instead of dustkappa_*.inp
+  python run_optool.py --material E40R --grain-size 0.3 --scattering
+
   # Core-mantle grain with built-in optool materials (30% water ice on pyroxene)
   python run_optool.py --material pyr --grain-size 0.3 --mantle-material h2o --mantle-fraction 0.3
         """,
@@ -244,12 +491,18 @@ Examples:
             'Built-in: run "optool -c" for full list.'
         ),
     )
-    parser.add_argument(
+    size_group = parser.add_mutually_exclusive_group()
+    size_group.add_argument(
         "--grain-size",
         type=float,
         default=DEFAULT_GRAIN_SIZE,
         help=f"Grain size in microns (default: {DEFAULT_GRAIN_SIZE})",
     )
+    size_group.add_argument(
+        "--grain-sizes",
+        default=None,
+        help="Comma-separated grain sizes in microns; one file per size (mutually exclusive with --grain-size)",
+    )
     parser.add_argument(
         "--temperatures",
         default=",".join(map(str, DEFAULT_TEMPERATURES)),
@@ -285,19 +538,35 @@ Examples:
         default=None,
         help="Mantle mass fraction relative to core (e.g. 0.2 = 20%%)",
     )
+    parser.add_argument(
+        "--scattering",
+        action="store_true",
+        help="Include the full scattering matrix (writes dustkapscatmat_*.inp files)",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Regenerate output files even if they are already up to date",
+    )
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=None,
+        help="Number of parallel Optool processes (default: one per temperature/grain-size run, capped at CPU count)",
+    )
     parser.add_argument(
         "-v", "--verbose",
         action="store_true",
         help="Enable verbose (debug) output",
     )
 
-    args = parser.parse_args()
+    return parser
 
-    # Configure logging
-    logging.basicConfig(
-        format="%(levelname)s: %(message)s",
-        level=logging.DEBUG if args.verbose else logging.INFO,
-    )
+
+def main(argv: list[str] | None = None) -> int:
+    args = build_parser().parse_args(argv)
+
+    _configure_logging(args.verbose)
 
     # --- Validation ----------------------------------------------------------
 
@@ -328,10 +597,29 @@ Examples:
         log.error("--mantle-fraction must be between 0 (exclusive) and 1 (inclusive).")
         return 1
 
-    # Grain size must be positive
-    if args.grain_size <= 0:
+    # Grain sizes must be positive
+    if args.grain_sizes is not None:
+        grain_sizes: list[float] = []
+        for g in args.grain_sizes.split(","):
+            g = g.strip()
+            try:
+                size = float(g)
+            except ValueError:
+                log.error("Invalid grain size value: '%s'", g)
+                return 1
+            if size <= 0:
+                log.error("Grain sizes must be positive, got %s.", g)
+                return 1
+            grain_sizes.append(size)
+    elif args.grain_size <= 0:
         log.error("--grain-size must be positive.")
         return 1
+    else:
+        grain_sizes = [args.grain_size]
+
+    if args.jobs is not None and args.jobs < 1:
+        log.error("--jobs must be at least 1.")
+        return 1
 
     # Warn about unknown materials
     for label, name in [("Core", args.material), ("Mantle", args.mantle_material)]:
@@ -342,37 +630,37 @@ Examples:
                 name,
             )
 
-    if not args.nk_dir.is_dir():
+    if _list_nk_dir(args.nk_dir) is None:
         log.error("Directory '%s' not found.", args.nk_dir)
         return 1
 
     # --- Execution -----------------------------------------------------------
 
-    if args.no_temp_dependent:
-        result = run_optool(
-            args.material,
-            args.grain_size,
-            nk_dir=args.nk_dir,
-            output_dir=args.output_dir,
-            mantle_material=args.mantle_material,
-            mantle_fraction=args.mantle_fraction,
-        )
-        return 0 if result else 1
+    import shutil
+    import tempfile
+    from concurrent.futures import ProcessPoolExecutor
 
-    temperatures: list[int] = []
-    for t in args.temperatures.split(","):
-        t = t.strip()
-        try:
-            val = int(t)
-        except ValueError:
-            log.error("Invalid temperature value: '%s'", t)
-            return 1
-        if val <= 0:
-            log.error("Temperatures must be positive, got %d.", val)
-            return 1
-        temperatures.append(val)
-
-    log.info("Generating opacity files for temperatures: %s", temperatures)
+    temperatures: list[int | None]
+    if args.no_temp_dependent:
+        temperatures = [None]
+    else:
+        temperatures = []
+        for t in args.temperatures.split(","):
+            t = t.strip()
+            try:
+                val = int(t)
+            except ValueError:
+                log.error("Invalid temperature value: '%s'", t)
+                return 1
+            if val <= 0:
+                log.error("Temperatures must be positive, got %d.", val)
+                return 1
+            temperatures.append(val)
+
+        log.info("Generating opacity files for temperatures: %s", temperatures)
+
+    if len(grain_sizes) > 1:
+        log.info("Grain sizes: %s", grain_sizes)
     if args.mantle_material:
         log.info(
             "Mantle: %s (%.1f%% of core mass)",
@@ -380,24 +668,85 @@ Examples:
             args.mantle_fraction * 100,
         )
 
-    success_count = sum(
-        1
-        for temp in temperatures
-        if run_optool(
+    # Checking up-to-date files here means a fully current sweep never starts
+    # a pool or creates a scratch directory.
+    tasks = [(temp, size) for temp in temperatures for size in grain_sizes]
+    pending: list[tuple[int | None, float]] = []
+    for temp, size in tasks:
+        final_name = _output_name(
             args.material,
-            args.grain_size,
+            size,
             temp,
-            args.nk_dir,
-            args.output_dir,
             args.mantle_material,
             args.mantle_fraction,
+            args.scattering,
         )
-    )
-
-    log.info("Generated %d/%d files.", success_count, len(temperatures))
-    log.info("Output directory: %s", args.output_dir.resolve())
+        inputs = _local_inputs(
+            args.material, temp, args.nk_dir, args.mantle_material, args.mantle_fraction
+        )
+        if not args.force and _is_up_to_date(args.output_dir / final_name, inputs):
+            log.info("Skipping %s, up to date.", final_name)
+        else:
+            pending.append((temp, size))
+
+    # Every (temperature, grain size) pair is an independent optool process,
+    # so run them in parallel. One scratch directory per batch (one
+    # subdirectory per worker) avoids a mkdir/rmdir round trip for every run.
+    results: list[Path | None] = []
+    if pending:
+        # Never start more workers (each with its own scratch dir) than tasks
+        jobs = min(args.jobs or os.cpu_count() or 1, len(pending))
+        run = partial(
+            run_optool,
+            args.material,
+            nk_dir=args.nk_dir,
+            output_dir=args.output_dir,
+            mantle_material=args.mantle_material,
+            mantle_fraction=args.mantle_fraction,
+            scattering=args.scattering,
+            force=args.force,
+            verbose=args.verbose,
+        )
+        _ensure_dir(args.output_dir)
+        batch_dir = Path(tempfile.mkdtemp(prefix="temp_optool_", dir=args.output_dir))
+        try:
+            if jobs == 1:
+                results = [
+                    run(size, temp, scratch_dir=batch_dir) for temp, size in pending
+                ]
+            else:
+                worker = partial(_run_optool_in_worker, run)
+                with ProcessPoolExecutor(
+                    max_workers=jobs,
+                    initializer=_init_worker,
+                    initargs=(batch_dir, args.verbose),
+                ) as executor:
+                    results = list(
+                        executor.map(
+                            worker,
+                            [size for _, size in pending],
+                            [temp for temp, _ in pending],
+                        )
+                    )
+        finally:
+            shutil.rmtree(batch_dir, ignore_errors=True)
+
+    success_count = sum(1 for result in results if result)
+    skipped_count = len(tasks) - len(pending)
+
+    if len(tasks) > 1 or not args.no_temp_dependent:
+        if skipped_count:
+            log.info(
+                "Generated %d/%d files (%d up to date).",
+                success_count,
+                len(tasks),
+                skipped_count,
+            )
+        else:
+            log.info("Generated %d/%d files.", success_count, len(tasks))
+        log.info("Output directory: %s", args.output_dir.resolve())
 
-    return 0 if success_count == len(temperatures) else 1
+    return 0 if success_count == len(pending) else 1
 
 
 if __name__ == "__main__":